@@ -1,50 +1,72 @@
-from datetime import datetime
-import json
 import os
+from queue import Empty, Queue
+from threading import Lock, Thread
 import time
 from typing import Any
 
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 from .discovery.integrated import Discovery
+from .discovery.win import _ts
 from .types import Update
 
 
 class SyncHost:
     # static
     POLL_TIME = 1
+    HTTP_TIMEOUT = 5  # seconds
+
+    VERBOSE: bool = False
 
     # fields
     host: str
     port: int
     addr: str
+    session: requests.Session
 
     room: str | None
     discovery = Discovery()
 
     _last_event: Update | None = None
 
+    _tx_queue: Queue  # holds at most one pending Update, None stops the sender
+    _tx_lock: Lock
+    _tx_thread: Thread
+
     def _get(self, path: str) -> dict[str, Any]:
-        resp = requests.get(self.addr + path)
+        resp = self.session.get(self.addr + path, timeout=SyncHost.HTTP_TIMEOUT)
         assert resp.status_code == 200
-        return json.loads(resp.content.decode())
+        return resp.json()
 
     def _post(self, path: str, data: Any) -> dict[str, Any]:
-        resp = requests.post(self.addr + path, data=data)
+        resp = self.session.post(
+            self.addr + path, data=data, timeout=SyncHost.HTTP_TIMEOUT
+        )
         assert resp.status_code == 200
-        return json.loads(resp.content.decode())
+        return resp.json()
 
     def __init__(self):
         self._last_event = None
+        self.VERBOSE = os.getenv("SYNC_VERBOSE", "0") == "1"
 
         self.host = os.getenv("SYNC_IP", "localhost")
         self.port = int(os.getenv("SYNC_PORT", 5400))
         self.addr = f"http://{self.host}:{self.port}"
 
+        # keep-alive connection to the sync server, reused between updates
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.session.mount(self.addr, HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
         self.room = None
         self.discovery = Discovery()
 
+        self._tx_queue = Queue(maxsize=1)
+        self._tx_lock = Lock()
+        self._tx_thread = Thread(target=self._sender, daemon=True)
+        self._tx_thread.start()
+
     def start(self, uid: str | None = None):
         if uid is None:
             self.room = self._get("/host/create")["token"]
@@ -56,39 +78,73 @@ class SyncHost:
 
     def stop(self):
         self.discovery.clear_callbacks()
+        self.discovery.stop()
+        self._enqueue(None)
+        self._tx_thread.join()
+        self.session.close()
+
+    def _enqueue(self, upd: Update | None):
+        # coalesce: a newer update replaces the one not yet sent
+        with self._tx_lock:
+            try:
+                self._tx_queue.get_nowait()
+            except Empty:
+                pass
+            self._tx_queue.put_nowait(upd)
+
+    def _sender(self):
+        while True:
+            upd = self._tx_queue.get()
+            if upd is None:
+                break
+            try:
+                # deployed servers read the update from the "json" form field
+                self._post(f"/host/update/{self.room}", {"json": upd.model_dump_json()})
+            except Exception as e:
+                print(
+                    f"[{_ts()}]",
+                    f"error upd post: {str(e)}",
+                )
 
     def update(self):
         if self.room is None:
             return
         try:
-            upd = Update(
-                track=self.discovery.get_current_track(),
-                playback=self.discovery.get_status(),
+            track = self.discovery.get_current_track()
+            playback = self.discovery.get_status()
+            if track is None or playback is None:
+                raise ValueError("nothing is playing")
+
+            # discovery hands out ready models, don't validate them again
+            upd = Update.model_construct(
+                track=track,
+                playback=playback,
+                next_track=self.discovery.get_next_track(),
             )
 
             if self._last_event is not None:
-                if upd.track == self._last_event:
-                    print("Skipped:", upd.format())
+                if upd == self._last_event:
+                    if self.VERBOSE:
+                        print("Skipped:", upd.format())
                     return  # skip, non-informative
 
-            print(
-                f"[{datetime.fromtimestamp(time.time()).strftime('%H:%M:%S.%f')}]",
-                upd.format(),
-            )
+            if self.VERBOSE:
+                print(
+                    f"[{_ts()}]",
+                    upd.format(),
+                )
             self._last_event = upd
-            self._post(f"/host/update/{self.room}", {"json": upd.model_dump_json()})
+            self._enqueue(upd)
         except Exception as e:
             print(
-                f"[{datetime.fromtimestamp(time.time()).strftime('%H:%M:%S.%f')}]",
-                f"error upd post: {str(e)}",
+                f"[{_ts()}]",
+                f"error upd: {str(e)}",
             )
             print(self.discovery.get_current_track())
             return
 
 
 def main():
-    load_dotenv()
-
     host = SyncHost()
     room = os.getenv("SYNC_ROOM", None)
     host.start(room)
@@ -1,11 +1,13 @@
 import datetime
-from threading import Lock, Thread
+import json
+from pathlib import Path
+from threading import Event, Lock, Thread
 import time
 from typing import Callable, Literal
 
 from ..types import Playback, Track, DiscoverySource, Source, Update
 
-from .win import WinRT_discovery
+from .win import WinRT_discovery, safe_callback
 from .yn import Ynison_discovery, Track as YTrack
 
 
@@ -13,6 +15,9 @@ class Discovery:
     # static
     YANDEX_POLL_TIME = 5
     GRACE_PERIOD = 15  # seconds after duration divergence to trust Yandex
+    CURRENT_TTL = 0.05  # seconds to reuse lastupdate within one tick
+    YANDEX_CACHE_PATH = Path.home() / ".cache" / "synchall" / "yandex_last.json"
+    YANDEX_CACHE_TTL = 600  # seconds the cached track is trusted on startup
 
     # fields
     winrt: WinRT_discovery | None
@@ -21,18 +26,28 @@ class Discovery:
     yandex_poll_mode: Literal["upd", "poll", "lazy"]
     yandex_poll_thread: Thread
     yandex_last_track: YTrack | None
+    yandex_next_track: YTrack | None  # queued after yandex_last_track
     yandex_startup: bool  # raised means "lazy" acts like "poll" to determine new track near beginning
     yandex_last_update: float  # unix time
+    yandex_warm: bool  # yandex_last_track came from disk cache, not yet confirmed
     yandex_track_lock: Lock
+    _stop: Event  # stops yandex_poll_thread
+    _wake: Event  # interrupts yandex_poll_thread sleep
 
     grace_armed: bool  # True after durations matched
-    grace_diverge_time: float | None  # when durations started differing
+    grace_diverge_time: float | None  # monotonic, when durations started differing
 
     desired_source: Source | None
 
     lastupdate: Update | None
+    _last_get_current_ts: float  # monotonic
+
+    # last converted tracks, keyed by the source track identity
+    _ytrack_cache: tuple[str, Track] | None
+    _wtrack_cache: tuple[tuple[str, str, float], Track] | None
 
     _callbacks: list[Callable]
+    _callbacks_snapshot: tuple[Callable, ...]  # rebuilt on mutation, iterated on events
 
     def __init__(
         self,
@@ -41,12 +56,23 @@ class Discovery:
     ):
         self.desired_source = desired_source
         self.lastupdate = None
+        self._last_get_current_ts = float("-inf")
+        self._ytrack_cache = None
+        self._wtrack_cache = None
         self._callbacks = []
+        self._callbacks_snapshot = ()
 
         self.yandex = None
         try:
             token = Ynison_discovery.get_session_id()
-            self.yandex = Ynison_discovery(token)
+            try:
+                self.yandex = Ynison_discovery(token)
+            except Exception:
+                # saved Session_id may have expired, ask the browser again
+                fresh = Ynison_discovery.get_session_id(skip_environ=True)
+                if fresh == token:
+                    raise
+                self.yandex = Ynison_discovery(fresh)
         except RuntimeError as re:
             if "Yandex" in needed_sources:
                 raise re
@@ -66,16 +92,24 @@ class Discovery:
 
         if self.winrt is not None:
             self.yandex_poll_mode = "upd"
+            self.winrt.on_update(self.invalidate)  # first, before anyone reads
             self.winrt.on_update(self.update_yandex)
         else:
             self.yandex_poll_mode = "lazy"
 
         self.yandex_last_track = None
+        self.yandex_next_track = None
+        self.yandex_warm = False
+        if self.yandex is not None:
+            self.yandex_last_track = self._load_yandex_cache()
+            self.yandex_warm = self.yandex_last_track is not None
         self.yandex_startup = True
         self.yandex_track_lock = Lock()
         self.grace_armed = False
         self.grace_diverge_time = None
         self.yandex_last_update = time.time()
+        self._stop = Event()
+        self._wake = Event()
         self.yandex_poll_thread = Thread(
             target=self.yandex_poll_thread_fun,
             daemon=True,
@@ -83,47 +117,83 @@ class Discovery:
         self.yandex_poll_thread.start()
 
     def on_update(self, callback: Callable):
-        self._callbacks.append(callback)
+        self._callbacks.append(safe_callback(callback))
+        self._callbacks_snapshot = tuple(self._callbacks)
         if self.winrt is not None:
             self.winrt.on_update(callback=callback)
 
     def clear_callbacks(self):
         self._callbacks.clear()
+        self._callbacks_snapshot = ()
         if self.winrt is not None:
             self.winrt.clear_callbacks()
+            self.winrt.on_update(self.invalidate)
             self.winrt.on_update(self.update_yandex)
 
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self.yandex is not None:
+            self.yandex.close()  # persistent state websocket
+
+    def _sleep(self, timeout: float):
+        self._wake.wait(timeout=timeout)
+        self._wake.clear()
+
     def update_yandex(self) -> bool:
         """Update current_track from yandex api. Returns True if any changes were made."""
         if self.yandex is None:
             return False
 
-        new_track = self.yandex.get_current_track()
+        state = self.yandex.get_player_state_assert()
+        new_track = self.yandex.get_current_track(state)
+
+        # racy fast path: unchanged track is the common case while polling
+        last = self.yandex_last_track
+        if last is not None and last.id == new_track.id:
+            self.yandex_warm = False
+            return False
+
+        try:
+            next_track = self.yandex.get_next_track(state)
+        except Exception as e:  # only a prefetch hint
+            print(f"Failed to get next yandex track: {str(e)}")
+            next_track = None
+
         with self.yandex_track_lock:
-            if (
-                self.yandex_last_track is None
-                or self.yandex_last_track.id != new_track.id
-            ):
-                if self.yandex_last_track is not None:
-                    self.yandex_startup = False
-                self.yandex_last_track = new_track
-                self.yandex_last_update = time.time()
-
-                # to avoid double invokation
-                if self.yandex_poll_mode != "upd" or self.winrt is None:
-                    for cb in self._callbacks:
-                        try:
-                            cb()
-                        except Exception as e:
-                            print(f"Error in callback: {str(e)}")
-                return True
-        return False
+            last = self.yandex_last_track
+            if last is not None and last.id == new_track.id:
+                return False  # updated concurrently
+
+            was_warm = self.yandex_warm
+            if last is not None and not was_warm:
+                self.yandex_startup = False
+            self.yandex_warm = False
+            self.yandex_last_track = new_track
+            self.yandex_next_track = next_track
+            self.yandex_last_update = time.time()
+
+        self._save_yandex_cache(new_track)
+        self.invalidate()
+
+        # to avoid double invokation, but a replaced cached track
+        # was already published and no winrt event will correct it
+        if was_warm or self.yandex_poll_mode != "upd" or self.winrt is None:
+            for cb in self._callbacks_snapshot:
+                cb()
+        return True
 
     def yandex_poll_thread_fun(self):
         if self.yandex is None:
             return
 
-        while True:
+        if self.yandex_warm:
+            try:
+                self.update_yandex()  # confirm the cached track in background
+            except Exception as e:
+                print(f"Failed to confirm cached yandex track: {str(e)}")
+
+        while not self._stop.is_set():
             if self.yandex_poll_mode == "upd":
                 pass  # update on winrt updates
             elif self.yandex_poll_mode == "poll":
@@ -133,23 +203,56 @@ class Discovery:
                 if self.update_yandex() and not self.yandex_startup:
                     delay = self.yandex_last_track.duration_ms or 0
                     delay = max(delay / 1000 - 10, 0)
-                    time.sleep(delay)
+                    self._sleep(delay)
                     continue
-            time.sleep(Discovery.YANDEX_POLL_TIME)
+            self._sleep(Discovery.YANDEX_POLL_TIME)
             continue
 
+    def _load_yandex_cache(self) -> YTrack | None:
+        path = Discovery.YANDEX_CACHE_PATH
+        try:
+            if time.time() - path.stat().st_mtime > Discovery.YANDEX_CACHE_TTL:
+                return None
+            data = json.loads(path.read_text())
+            return YTrack.de_json(data, self.yandex.client)
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+    def _save_yandex_cache(self, track: YTrack):
+        data = {
+            "id": str(track.id),
+            "title": track.title,
+            "artists": [{"name": artist.name} for artist in track.artists],
+            "duration_ms": track.duration_ms,
+        }
+        try:
+            Discovery.YANDEX_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            Discovery.YANDEX_CACHE_PATH.write_text(json.dumps(data))
+        except OSError as e:
+            print(f"Failed to save yandex track cache: {str(e)}")
+
     def convert_current_track_yandex(self) -> Track | None:
         if self.yandex is None:
             return None
 
-        with self.yandex_track_lock:
-            track = self.yandex_last_track
+        track = self.yandex_last_track  # reference is swapped atomically
         if track is None:
             return None
 
+        track_id = str(track.id)
+        cache = self._ytrack_cache
+        if cache is not None and cache[0] == track_id:
+            return cache[1]
+
+        converted = Discovery._from_yandex(track)
+        self._ytrack_cache = (track_id, converted)
+        return converted
+
+    @staticmethod
+    def _from_yandex(track: YTrack) -> Track:
         artist = track.artists[0].name if len(track.artists) > 0 else ""
 
-        return Track(
+        return Track.model_construct(
             source="Yandex",
             id=str(track.id),
             title=track.title or "",
@@ -157,6 +260,16 @@ class Discovery:
             duration_ms=track.duration_ms or 0,
         )
 
+    def get_next_track(self) -> Track | None:
+        """Track queued after the current one, if it is known (Yandex only)."""
+        if self.lastupdate is None or self.lastupdate.track.source != "Yandex":
+            return None
+
+        track = self.yandex_next_track
+        if track is None:
+            return None
+        return Discovery._from_yandex(track)
+
     def convert_current_track_winrt(self) -> Track | None:
         if self.winrt is None:
             return None
@@ -166,21 +279,29 @@ class Discovery:
             return None
 
         duration_ms = track.duration.total_seconds() * 1000 if track.duration else 0
-        return Track(
+        key = (track.title, track.artist, duration_ms)
+        cache = self._wtrack_cache
+        if cache is not None and cache[0] == key:
+            return cache[1]
+
+        converted = Track.model_construct(
             source="Local",
             id=track.title,
             title=track.title,
             artist=track.artist,
             duration_ms=int(duration_ms),
         )
+        self._wtrack_cache = (key, converted)
+        return converted
 
     def convert_current_status_winrt(self) -> Playback | None:
         if self.winrt is None:
             return None
 
-        state = Playback.from_win(self.winrt.status)
-        position_ms = self.winrt.get_position().total_seconds() * 1000
-        return Playback(
+        status, position = self.winrt.get_status_position()
+        state = Playback.from_win(status)
+        position_ms = position.total_seconds() * 1000
+        return Playback.model_construct(
             state=state,
             position_ms=int(position_ms),
             updated_at=time.time(),
@@ -194,6 +315,7 @@ class Discovery:
         if ytrack is None:
             return None
 
+        t = time.time()
         wtrack = self.convert_current_track_winrt()
         if wtrack is not None:
             durations_match = abs(wtrack.duration_ms - ytrack.duration_ms) < 200
@@ -212,9 +334,10 @@ class Discovery:
                 )
 
             if self.grace_armed:
+                mono = time.monotonic()
                 if self.grace_diverge_time is None:
-                    self.grace_diverge_time = time.time()
-                elapsed = time.time() - self.grace_diverge_time
+                    self.grace_diverge_time = mono
+                elapsed = mono - self.grace_diverge_time
                 if elapsed < Discovery.GRACE_PERIOD:
                     # Within grace: trust Yandex, use divergence time as track start
                     return Update(
@@ -222,7 +345,7 @@ class Discovery:
                         playback=Playback(
                             state="Playing",
                             position_ms=int(elapsed * 1000),
-                            updated_at=time.time(),
+                            updated_at=t,
                         ),
                     )
                 else:
@@ -237,9 +360,7 @@ class Discovery:
             self.lastupdate is not None and self.lastupdate.track.id == ytrack.id
         ):  # update position
             position_ms = self.lastupdate.playback.position_ms
-            position_ms += int(
-                (time.time() - self.lastupdate.playback.updated_at) * 1000
-            )
+            position_ms += int((t - self.lastupdate.playback.updated_at) * 1000)
         state = "Playing"
         if position_ms > ytrack.duration_ms:
             state = "Stopped"
@@ -249,11 +370,27 @@ class Discovery:
             playback=Playback(
                 state=state,
                 position_ms=position_ms,
-                updated_at=time.time(),
+                updated_at=t,
             ),
         )
 
+    def invalidate(self):
+        """Drop the memoized current state, a source has changed."""
+        self._last_get_current_ts = float("-inf")
+
     def _get_current(self) -> Update | None:
+        # track and status are read separately on each tick, compute them once
+        mono = time.monotonic()
+        if (
+            self.lastupdate is not None
+            and mono - self._last_get_current_ts < Discovery.CURRENT_TTL
+        ):
+            return self.lastupdate
+
+        self._last_get_current_ts = mono
+        return self._fetch_current()
+
+    def _fetch_current(self) -> Update | None:
         if self.desired_source == "Yandex":
             self.lastupdate = self.get_current_track_yandex(forced=True)
             return self.lastupdate
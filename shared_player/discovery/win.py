@@ -3,8 +3,10 @@ from __future__ import annotations
 import asyncio
 from datetime import datetime, timedelta, timezone
 from enum import Enum
+from queue import Empty, Queue
+from threading import Lock, Thread, current_thread
 import time
-from typing import Any, Callable
+from typing import Any, Callable, Coroutine, TypeVar
 
 from pydantic import BaseModel
 from winrt.windows.media.control import (
@@ -40,6 +42,11 @@ class TUpdate(Enum):
     Metadata = "M"
 
 
+WinEvent = tuple[MediaSession, TUpdate, float]  # session, type, monotonic time
+
+
+T = TypeVar("T")
+
 NULLDATE = datetime(1601, 1, 1, 0, 0, tzinfo=timezone.utc)
 
 
@@ -47,14 +54,40 @@ def now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def _ts() -> str:
+    return datetime.now().strftime("%H:%M:%S.%f")
+
+
+def safe_callback(callback: Callable) -> Callable:
+    """Wrap callback once so event loops can call it without try/except."""
+
+    def wrapped():
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in callback: {str(e)}")
+
+    return wrapped
+
+
 class WinRT_discovery:
     # static
     ARMED_TIMEOUT_MS = 2500
+    ARMED_TIMEOUT = ARMED_TIMEOUT_MS / 1000  # seconds
+    SEEK_WINDOW = timedelta(milliseconds=1)  # T right after S means playing
+    POSITION_TOLERANCE = timedelta(seconds=1)  # drift not worth notifying about
+    METADATA_DEBOUNCE = 0.075  # seconds to wait for more metadata events in a burst
 
     # fields
     manager: MediaManager
-
-    current_track: WTrack | None = None
+    _loop: asyncio.AbstractEventLoop  # persistent loop for WinRT async calls
+    _loop_thread: Thread
+    _winrt_q: Queue  # WinEvent from WinRT handlers
+    _winrt_thread: Thread
+
+    _state_lock: Lock  # guards current_track, status and position together
+    current_track: WTrack | None = None  # replaced, never mutated in place
+    _last_meta: tuple[str, str, timedelta | None] | None = None  # artist, title, end
     status: PlaybackStatus = PlaybackStatus.STOPPED
     position: timedelta = timedelta()
     _position_last_update: datetime = now()
@@ -66,11 +99,12 @@ class WinRT_discovery:
     _metadata_update_reg_token: EventRegistrationToken
 
     _callbacks: list[Callable]
+    _callbacks_snapshot: tuple[Callable, ...]  # rebuilt on mutation, iterated on events
 
     # Armed toggle state for deferred play/pause detection
     _armed_toggle_to: PlaybackStatus | None = None
-    _armed_time: datetime = NULLDATE
-    _last_playback_event_time: datetime = NULLDATE
+    _armed_time: float = float("-inf")  # monotonic
+    _last_playback_event_time: float = float("-inf")  # monotonic
 
     VERBOSE: bool = False
 
@@ -92,6 +126,7 @@ class WinRT_discovery:
                 self._metadata_update_reg_token
             )
         self._target_session = session
+        self._last_meta = None  # fetch the new session's media properties
         self._timeline_update_reg_token = (
             self._target_session.add_timeline_properties_changed(self._update_handler_t)
         )
@@ -112,15 +147,31 @@ class WinRT_discovery:
         assert media_props is not None
         return media_props
 
+    def _run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run coro on the persistent loop and wait for the result."""
+        if current_thread() is self._loop_thread:
+            raise RuntimeError("WinRT calls can't block the loop thread")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
     def __init__(self):
         self._callbacks = []
+        self._callbacks_snapshot = ()
+        self._state_lock = Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+
+        self._winrt_q = Queue()
+        self._winrt_thread = Thread(target=self._winrt_thread_fun, daemon=True)
+        self._winrt_thread.start()
 
         try:
-            self.manager = asyncio.run(WinRT_discovery.get_manager())
+            self.manager = self._run(WinRT_discovery.get_manager())
         except Exception as e:
             raise RuntimeError(f"Failed to get media sessions manager {e}")
 
-        if not self._get_current_session():
+        if not self._get_current_session() and self.VERBOSE:
             print("Failed to get current session")
 
     def _get_current_session(self) -> bool:
@@ -129,14 +180,17 @@ class WinRT_discovery:
             return False
 
         self.target_session = session
-        self._update_handler(self.target_session, TUpdate.Metadata)
+        # through the queue, only the worker runs _update_handler
+        self._winrt_q.put((session, TUpdate.Metadata, time.monotonic()))
         return True
 
     def on_update(self, callback: Callable):
-        self._callbacks.append(callback)
+        self._callbacks.append(safe_callback(callback))
+        self._callbacks_snapshot = tuple(self._callbacks)
 
     def clear_callbacks(self):
         self._callbacks.clear()
+        self._callbacks_snapshot = ()
 
     def capture_session(self, session_id: str = "Automatic") -> bool:
         all_sessions = self.manager.get_sessions()
@@ -155,34 +209,82 @@ class WinRT_discovery:
 
         return self._get_current_session()
 
+    # WinRT handlers only enqueue, so the OS dispatcher is never blocked
     def _update_handler_p(self, session: MediaSession, _args: Any):
-        self._last_playback_event_time = now()
-        self._update_handler(session, TUpdate.Playback)
+        self._winrt_q.put((session, TUpdate.Playback, time.monotonic()))
 
     def _update_handler_t(self, session: MediaSession, _args: Any):
         update_type = TUpdate.Timeline
         if session.get_timeline_properties().position.microseconds == 0:
             update_type = TUpdate.Seek
 
-        self._update_handler(session, update_type)
+        self._winrt_q.put((session, update_type, time.monotonic()))
 
     def _update_handler_m(self, session: MediaSession, _args: Any):
-        self._update_handler(session, TUpdate.Metadata)
+        self._winrt_q.put((session, TUpdate.Metadata, time.monotonic()))
+
+    def _next_event(self, pending: WinEvent | None) -> tuple[WinEvent, WinEvent | None]:
+        """Next event to handle, with a run of identical M or P events collapsed.
+
+        Timeline events are never merged, the CLOSED status heuristics rely on
+        their exact sequence. Returns the event and the first one not merged.
+        """
+        item = pending if pending is not None else self._winrt_q.get()
+        update_type = item[1]
+        if update_type == TUpdate.Metadata:
+            timeout = WinRT_discovery.METADATA_DEBOUNCE
+        elif update_type == TUpdate.Playback:
+            timeout = None  # only merge what is already queued
+        else:
+            return item, None
+
+        while True:
+            try:
+                if timeout is None:
+                    nxt = self._winrt_q.get_nowait()
+                else:
+                    nxt = self._winrt_q.get(timeout=timeout)
+            except Empty:
+                return item, None
+            if nxt[1] != update_type:
+                return item, nxt
+            item = nxt
+
+    def _winrt_thread_fun(self):
+        pending = None
+        while True:
+            (session, update_type, event_time), pending = self._next_event(pending)
+            if update_type == TUpdate.Playback:
+                # set in queue order, so T events queued before it don't see it
+                self._last_playback_event_time = event_time
+            try:
+                self._update_handler(session, update_type)
+            except Exception as e:
+                print(f"Error in WinRT update: {str(e)}")
 
     def _update_handler(self, session: MediaSession, update_type: TUpdate):
-        info = asyncio.run(WinRT_discovery.get_properties(session))
         position = session.get_timeline_properties()
-        playback_info = session.get_playback_info().playback_status
+        playback = session.get_playback_info()
+        playback_info = playback.playback_status
+        _now = now()
+        mono = time.monotonic()
+
+        # media properties are the only async call, fetch them only when changed
+        if update_type == TUpdate.Metadata or self._last_meta is None:
+            info = self._run(WinRT_discovery.get_properties(session))
+            artist, title = info.artist, info.title
+        else:
+            artist, title, _ = self._last_meta
 
         if self.VERBOSE:
-            ts = f"[{datetime.fromtimestamp(time.time()).strftime('%H:%M:%S.%f')}]"
+            ts = f"[{_ts()}]"
             match update_type:
                 case TUpdate.Playback:
                     print(
                         ts,
                         f"playback update: {playback_info.name}, "
-                        f"type: {info.playback_type.name if info.playback_type else info.playback_type}, "
-                        f"timeline updated: {now() - position.last_updated_time} ago",
+                        f"type: {playback.playback_type.name if playback.playback_type else playback.playback_type}, "
+                        f"timeline updated: {_now - position.last_updated_time} ago",
                     )
                 case TUpdate.Timeline:
                     print(
@@ -199,93 +301,134 @@ class WinRT_discovery:
                 case TUpdate.Metadata:
                     print(
                         ts,
-                        f"metadata update: {info.artist} - {info.title} [{position.end_time}]",
+                        f"metadata update: {artist} - {title} [{position.end_time}]",
                     )
 
-        if self.current_track is None:
-            self.current_track = WTrack.new()
-
-        self.current_track.artist = info.artist
-        self.current_track.title = info.title
-        self.current_track.duration = position.end_time
+        new_meta = (artist, title, position.end_time)
+        meta_changed = new_meta != self._last_meta
+        new_track = self.current_track
+        if meta_changed:
+            new_track = WTrack(artist=artist, title=title, duration=position.end_time)
+            self._last_meta = new_meta
 
-        old_status = new_status = self.status
-        armed_timeout = timedelta(milliseconds=WinRT_discovery.ARMED_TIMEOUT_MS)
-
-        if playback_info == PlaybackStatus.CLOSED:  # ill update from Ya.Music
-            # P event confirms armed toggle (for pause: T, P, P scenario)
-            if update_type == TUpdate.Playback and self._armed_toggle_to is not None:
-                if now() - self._armed_time < armed_timeout:
-                    new_status = self._armed_toggle_to
-                self._armed_toggle_to = None
-
-            elif update_type == TUpdate.Timeline:
-                recent_p = now() - self._last_playback_event_time < armed_timeout
-
-                if (
-                    self._last_meaning_update == TUpdate.Seek
-                    and now() - self._position_last_update < timedelta(milliseconds=1)
-                ):
-                    new_status = PlaybackStatus.PLAYING
-                elif self._last_meaning_update == TUpdate.Metadata:
-                    new_status = PlaybackStatus.PLAYING
-                elif recent_p:
-                    # P came before T (play: P, P, T), apply immediately
-                    if old_status == PlaybackStatus.PAUSED:
-                        new_status = PlaybackStatus.PLAYING
-                    elif old_status == PlaybackStatus.PLAYING:
-                        new_status = PlaybackStatus.PAUSED
-                else:
-                    # Arm toggle for confirmation (pause: T, P, P)
-                    if old_status == PlaybackStatus.PAUSED:
-                        self._armed_toggle_to = PlaybackStatus.PLAYING
-                    elif old_status == PlaybackStatus.PLAYING:
-                        self._armed_toggle_to = PlaybackStatus.PAUSED
-                    self._armed_time = now()
-        else:
-            new_status = playback_info
+        old_status, old_position = self.get_status_position()
+        new_status = self._resolve_status(update_type, playback_info, _now, mono)
 
         # foobar2000 doesn't send timeline updates
         if position.last_updated_time == NULLDATE:
-            print(
-                f"Old pos: {self.position}, new_pos: {self.get_position()}, "
-                f"status: {self.status.name}"
-            )
+            if self.VERBOSE:
+                print(
+                    f"Old pos: {self.position}, new_pos: {old_position}, "
+                    f"status: {old_status.name}"
+                )
+            new_position = self.position
             if new_status == PlaybackStatus.PAUSED:
-                self.position = self.get_position()
-            self._position_last_update = now()
+                new_position = old_position
+            position_last_update = _now
         else:
-            self._position_last_update = position.last_updated_time
+            position_last_update = position.last_updated_time
             if (
                 old_status == PlaybackStatus.PAUSED
                 and new_status == PlaybackStatus.PLAYING
             ):  # timeline updates may arrive late, and we use this to extrapolate
-                self._position_last_update = now()
-            self.position = position.position
-        self.status = new_status
+                position_last_update = _now
+            new_position = position.position
+
+        # readers must never see a half-applied update
+        with self._state_lock:
+            self.current_track = new_track
+            self.status = new_status
+            self.position = new_position
+            self._position_last_update = position_last_update
 
         if update_type != TUpdate.Playback:
             self._last_meaning_update = update_type
 
-        for cb in self._callbacks:
-            try:
-                cb()
-            except Exception as e:
-                print(f"Error in callback: {str(e)}")
+        # players often repeat identical events, don't notify about those
+        if (
+            not meta_changed
+            and new_status == old_status
+            and abs(self.get_position() - old_position)
+            < WinRT_discovery.POSITION_TOLERANCE
+        ):
+            return
+
+        for cb in self._callbacks_snapshot:
+            cb()
+
+    def _resolve_status(
+        self,
+        update_type: TUpdate,
+        playback_info: PlaybackStatus,
+        _now: datetime,
+        mono: float,
+    ) -> PlaybackStatus:
+        """Playback state machine step, makes no WinRT calls."""
+        if playback_info != PlaybackStatus.CLOSED:
+            return playback_info
+
+        # ill update from Ya.Music
+        old_status = new_status = self.status
+
+        # P event confirms armed toggle (for pause: T, P, P scenario)
+        if update_type == TUpdate.Playback and self._armed_toggle_to is not None:
+            if mono - self._armed_time < WinRT_discovery.ARMED_TIMEOUT:
+                new_status = self._armed_toggle_to
+            self._armed_toggle_to = None
+
+        elif update_type == TUpdate.Timeline:
+            recent_p = (
+                mono - self._last_playback_event_time < WinRT_discovery.ARMED_TIMEOUT
+            )
+
+            if (
+                self._last_meaning_update == TUpdate.Seek
+                and _now - self._position_last_update < WinRT_discovery.SEEK_WINDOW
+            ):
+                new_status = PlaybackStatus.PLAYING
+            elif self._last_meaning_update == TUpdate.Metadata:
+                new_status = PlaybackStatus.PLAYING
+            elif recent_p:
+                # P came before T (play: P, P, T), apply immediately
+                if old_status == PlaybackStatus.PAUSED:
+                    new_status = PlaybackStatus.PLAYING
+                elif old_status == PlaybackStatus.PLAYING:
+                    new_status = PlaybackStatus.PAUSED
+            else:
+                # Arm toggle for confirmation (pause: T, P, P)
+                if old_status == PlaybackStatus.PAUSED:
+                    self._armed_toggle_to = PlaybackStatus.PLAYING
+                elif old_status == PlaybackStatus.PLAYING:
+                    self._armed_toggle_to = PlaybackStatus.PAUSED
+                self._armed_time = mono
+
+        return new_status
 
     def print_upd(self):
-        if self.current_track is not None:
+        with self._state_lock:
+            track, status, position = self.current_track, self.status, self.position
+        if track is not None:
             print(
-                f"{self.status.name} [{self.position} / {self.current_track.duration}] "
-                f"{self.current_track.artist} - {self.current_track.title}"
+                f"{status.name} [{position} / {track.duration}] "
+                f"{track.artist} - {track.title}"
             )
         else:
-            print(f"{self.status.name} - no track")
+            print(f"{status.name} - no track")
 
     def get_current_track(self) -> WTrack | None:
-        return self.current_track
+        with self._state_lock:
+            track = self.current_track
+        return track.model_copy() if track is not None else None
+
+    def get_status_position(self) -> tuple[PlaybackStatus, timedelta]:
+        """Consistent status and extrapolated position."""
+        with self._state_lock:
+            status = self.status
+            position = self.position
+            last_update = self._position_last_update
+        if status == PlaybackStatus.PLAYING:
+            return status, now() - last_update + position
+        return status, position
 
     def get_position(self) -> timedelta:
-        if self.status == PlaybackStatus.PLAYING:
-            return now() - self._position_last_update + self.position
-        return self.position
+        return self.get_status_position()[1]
@@ -3,16 +3,24 @@ import json
 import os
 import time
 import uuid
+from collections import OrderedDict
+from threading import Lock
 from typing import Any
 from urllib.parse import quote
 
 import browser_cookie3
 import websockets
-from dotenv import load_dotenv, set_key, find_dotenv
+from websockets.sync.client import ClientConnection, connect as ws_connect
+from dotenv import set_key, find_dotenv
 from yandex_music import Track, Client
 
+from ..downloads._ym import get_ym_client
 
-def default_payload(device_id: str) -> dict[str, Any]:
+
+RID_PLACEHOLDER = "<rid>"
+
+
+def default_payload(device_id: str, rid: str | None = None) -> dict[str, Any]:
     return {
         "update_full_state": {
             "player_state": {
@@ -67,13 +75,14 @@ def default_payload(device_id: str) -> dict[str, Any]:
             "is_currently_active": False,
             "sync_state_from_eov_optional": None,
         },
-        "rid": str(uuid.uuid4()),
+        "rid": rid if rid is not None else str(uuid.uuid4()),
         "player_action_timestamp_ms": 0,
         "activity_interception_type": "DO_NOT_INTERCEPT_BY_DEFAULT",
     }
 
 
 def status_payload(device_id: str) -> dict[str, Any]:
+    ts = int(time.time())
     return {
         "update_playing_status": {
             "playing_status": {
@@ -84,12 +93,12 @@ def status_payload(device_id: str) -> dict[str, Any]:
                 "version": {
                     "device_id": device_id,
                     "version": 1635218570935773200,
-                    "timestamp_ms": int(time.time()),
+                    "timestamp_ms": ts,
                 },
             }
         },
         "rid": "941b0c45-de3d-4b93-93dc-c6c8ccd70aed",
-        "player_action_timestamp_ms": int(time.time()),
+        "player_action_timestamp_ms": ts,
         "activity_interception_type": "DO_NOT_INTERCEPT_BY_DEFAULT",
     }
 
@@ -98,6 +107,8 @@ class Ynison_discovery:
     # static
     RATE_LIMIT = 1  # queries per second
     WS_RETRIES = 3
+    WS_TIMEOUT = 5  # seconds to wait for a state reply
+    TRACK_CACHE_SIZE = 4  # current and next tracks, with some slack
 
     # fields
     session_id: str
@@ -114,37 +125,46 @@ class Ynison_discovery:
     ynison_shard: str
     ynison_session_id: str
     ynison_ticket: str
+    state_proto_meta_pct: str  # subprotocol for the state shard, fixed per ticket
+
+    _default_frame: tuple[str, str]  # serialized default payload split around rid
+    _ynison_ws: ClientConnection | None = None  # persistent state connection
+    _ynison_lock: Lock
 
     client: Client
+    _track_cache: OrderedDict[str, Track]  # track_id -> Track, lru
+    _track_lock: Lock
     last_query: float  # unix time
 
     @staticmethod
     def get_session_id(skip_environ: bool = False) -> str:
-        cj = browser_cookie3.firefox(domain_name="yandex.ru")
-        for cookie in cj:
-            if cookie.name == "Session_id":
-                assert cookie.value is not None, (
-                    "Failed to extract Session_id from cookies"
-                )
-                return cookie.value
-
+        # saved after the last successful login, opening the cookie store is slow
         session_id: str | None = None
         if not skip_environ:
             session_id = os.environ.get("Y_SESSION_ID", None)
+            if session_id:
+                return session_id
 
-        if session_id is None:
+        cj = browser_cookie3.firefox(domain_name="yandex.ru")
+        session_id = next((c.value for c in cj if c.name == "Session_id"), None)
+
+        if not session_id:
             raise RuntimeError(
                 "Login to https://music.yandex.ru in firefox to use yandex.music integration."
             )
         return session_id
 
     def __init__(self, session_id: str | None = None):
-        load_dotenv()
         if session_id is None:
             session_id = os.environ.get("Y_SESSION_ID", None)
 
         assert session_id is not None, "Login to https://music.yandex.ru in firefox"
 
+        self._ynison_ws = None
+        self._ynison_lock = Lock()
+        self._track_cache = OrderedDict()
+        self._track_lock = Lock()
+
         self.load_ynison_init_state(session_id)
         self.load_ym_client()
 
@@ -159,6 +179,13 @@ class Ynison_discovery:
 
         self.device_id = str(uuid.uuid4())
 
+        # only rid changes between default queries
+        frame = json.dumps(
+            default_payload(self.device_id, RID_PLACEHOLDER), separators=(",", ":")
+        )
+        head, tail = frame.split(RID_PLACEHOLDER)
+        self._default_frame = (head, tail)
+
         self.headers = {
             "Origin": "https://music.yandex.ru",
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36",
@@ -174,10 +201,7 @@ class Ynison_discovery:
         )
 
     def load_ym_client(self):
-        token = os.environ.get("TOKEN", "")
-
-        self.client = Client(token)
-        self.client.init()
+        self.client = get_ym_client()
         self.last_query = time.time()
 
     def get_jumphost(self):
@@ -211,10 +235,6 @@ class Ynison_discovery:
         self.ynison_session_id = response["session_id"]
         self.ynison_ticket = response["redirect_ticket"]
 
-    def get_player_state(self, payload: dict[str, Any] | None = None) -> dict[str, Any]:
-        if payload is None:
-            payload = default_payload(self.device_id)
-
         SEC_PROTO_META = json.dumps(
             {
                 "Ynison-Device-Id": self.device_id,
@@ -224,31 +244,70 @@ class Ynison_discovery:
                 "X-Yandex-Music-Multi-Auth-User-Id": self.user_id,
             }
         )
+        self.state_proto_meta_pct = quote(SEC_PROTO_META, safe="")
 
-        proto_meta_pct = quote(SEC_PROTO_META, safe="")
-
-        async def conn():
-            td = 1 / Ynison_discovery.RATE_LIMIT
-            delay = self.last_query + td - time.time()
-            if delay > 0:
-                await asyncio.sleep(delay)
+        # new ticket, the old connection is bound to the previous one
+        with self._ynison_lock:
+            self._close_ws()
 
-            async with websockets.connect(
+    def _close_ws(self):
+        if self._ynison_ws is not None:
+            try:
+                self._ynison_ws.close()
+            except Exception:
+                pass
+            self._ynison_ws = None
+
+    def close(self):
+        with self._ynison_lock:
+            self._close_ws()
+
+    def _exchange(self, frame: str) -> dict[str, Any]:
+        if self._ynison_ws is None:
+            self._ynison_ws = ws_connect(
                 self.ynison_shard,
                 additional_headers=self.headers,
-                subprotocols=["Bearer", "v2", proto_meta_pct],  # type: ignore
-            ) as ws:
-                await ws.send(json.dumps(payload))
-                res = json.loads(await ws.recv())
-                self.last_query = time.time()
-                return res
+                subprotocols=["Bearer", "v2", self.state_proto_meta_pct],  # type: ignore
+            )
+        ws = self._ynison_ws
 
-        e = None
-        for i in range(Ynison_discovery.WS_RETRIES):
+        # drop states pushed since the last query, they are stale by now
+        while True:
             try:
-                return asyncio.run(conn())
-            except websockets.exceptions.ConnectionClosedOK as exc:
-                e = exc
+                ws.recv(timeout=0)
+            except TimeoutError:
+                break
+
+        ws.send(frame)
+        return json.loads(ws.recv(timeout=Ynison_discovery.WS_TIMEOUT))
+
+    def get_player_state(self, payload: dict[str, Any] | None = None) -> dict[str, Any]:
+        if payload is None:
+            head, tail = self._default_frame
+            frame = head + str(uuid.uuid4()) + tail
+        else:
+            frame = json.dumps(payload, separators=(",", ":"))  # compact frame
+
+        td = 1 / Ynison_discovery.RATE_LIMIT
+        with self._ynison_lock:
+            delay = self.last_query + td - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            e = None
+            for i in range(Ynison_discovery.WS_RETRIES):
+                try:
+                    res = self._exchange(frame)
+                    self.last_query = time.time()
+                    return res
+                except (
+                    websockets.exceptions.ConnectionClosed,
+                    TimeoutError,  # half-open socket or a dropped frame
+                    OSError,
+                ) as exc:
+                    # reconnect on the next try
+                    self._close_ws()
+                    e = exc
         return {"error": str(e)}
 
     def get_player_state_assert(
@@ -275,10 +334,7 @@ class Ynison_discovery:
             case _:
                 raise RuntimeError(f"Unknown entity {queue['entity_type']}")
 
-        tracks = self.client.tracks(track_id)
-        assert len(tracks) > 0, f"Illegal track_id {track_id}"
-
-        return tracks[0]
+        return self.get_track(track_id)
 
     def get_next_track(self, state: dict[str, Any] | None = None) -> Track | None:
         if state is None:
@@ -289,14 +345,27 @@ class Ynison_discovery:
             case "PLAYLIST" | "RADIO":
                 i = queue["current_playable_index"]
                 playlist = queue["playable_list"]
-                if len(playlist) >= i:
-                    track_id = playlist[i + 1]["playable_id"]
-                else:
+                if i + 1 >= len(playlist):
                     return None
+                track_id = playlist[i + 1]["playable_id"]
             case _:
                 raise RuntimeError(f"Unknown entity {queue['entity_type']}")
 
+        return self.get_track(track_id)
+
+    def get_track(self, track_id: str) -> Track:
+        # the next track becomes the current one, don't look it up twice
+        with self._track_lock:
+            track = self._track_cache.get(track_id)
+            if track is not None:
+                self._track_cache.move_to_end(track_id)
+                return track
+
         tracks = self.client.tracks(track_id)
         assert len(tracks) > 0, f"Illegal track_id {track_id}"
 
+        with self._track_lock:
+            self._track_cache[track_id] = tracks[0]
+            while len(self._track_cache) > Ynison_discovery.TRACK_CACHE_SIZE:
+                self._track_cache.popitem(last=False)
         return tracks[0]
@@ -0,0 +1,14 @@
+from functools import lru_cache
+import os
+
+from yandex_music import Client
+
+
+@lru_cache(maxsize=1)
+def get_ym_client() -> Client:
+    """Process-wide yandex_music client, authorized once."""
+    token = os.environ.get("TOKEN", "")
+
+    client = Client(token=token)
+    client.init()
+    return client
@@ -1,29 +1,61 @@
-import os
+from collections import OrderedDict
+from threading import Lock
+import time
 
-from dotenv import load_dotenv
 from yandex_music import Client
 from ymd.api import ApiTrackQuality, get_download_info
 
+from ._ym import get_ym_client
 from ..types import Track, DownloadInfo
 
 
 class YnisonFinder:
+    # static
+    QUALITY = ApiTrackQuality.NORMAL
+    CACHE_SIZE = 128
+    CACHE_TTL = 600  # seconds, download urls are signed and expire
+
+    # fields
     client: Client
 
-    def __init__(self):
-        load_dotenv()
+    _cache: OrderedDict[str, tuple[float, DownloadInfo]]  # id -> (monotonic, info)
+    _cache_lock: Lock
 
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
         self.load_ym_client()
 
     def load_ym_client(self):
-        token = os.environ.get("TOKEN", "")
-
-        self.client = Client(token=token)
-        self.client.init()
+        self.client = get_ym_client()
 
     def find(self, track: Track) -> DownloadInfo:
+        cached = self._cache_get(track.id)
+        if cached is not None:
+            return cached
+
         tracks = self.client.tracks(track.id)
         assert len(tracks) > 0
 
-        dinfo = get_download_info(tracks[0], quality=ApiTrackQuality.NORMAL)
-        return DownloadInfo(url=dinfo.urls[0], decryption_key=dinfo.decryption_key)
+        dinfo = get_download_info(tracks[0], quality=YnisonFinder.QUALITY)
+        info = DownloadInfo(url=dinfo.urls[0], decryption_key=dinfo.decryption_key)
+        self._cache_put(track.id, info)
+        return info
+
+    def _cache_get(self, track_id: str) -> DownloadInfo | None:
+        with self._cache_lock:
+            entry = self._cache.get(track_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > YnisonFinder.CACHE_TTL:
+                del self._cache[track_id]
+                return None
+            self._cache.move_to_end(track_id)
+            return entry[1]
+
+    def _cache_put(self, track_id: str, info: DownloadInfo):
+        with self._cache_lock:
+            self._cache[track_id] = (time.monotonic(), info)
+            self._cache.move_to_end(track_id)
+            while len(self._cache) > YnisonFinder.CACHE_SIZE:
+                self._cache.popitem(last=False)
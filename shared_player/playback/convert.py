@@ -1,11 +1,12 @@
-from queue import Empty, Queue
+from collections import deque
+import os
 import subprocess
 from threading import Event, Lock, Thread
 
 
 class StreamConvert:
     # static
-    CHUNK_SIZE = 4096
+    CHUNK_SIZE = 64 * 1024  # max bytes drained from ffmpeg stdout per read
 
     # fields
     ffmpeg_cmd: list[str]
@@ -13,13 +14,15 @@ class StreamConvert:
     sample_rate: int
     channels: int
 
-    write_buffer: Queue
-    read_buffer: bytearray
+    read_buffer: deque[memoryview]  # chunks of converted PCM, oldest first
+    _head_off: int  # bytes already consumed from read_buffer[0]
+    _read_size: int  # unconsumed bytes in read_buffer
 
-    _write_thread: Thread
     _read_thread: Thread
+    _err_thread: Thread  # drains stderr so ffmpeg never blocks on it
 
     _buf_lock: Lock
+    _write_lock: Lock
     _stopped: Event
 
     @staticmethod
@@ -62,56 +65,86 @@ class StreamConvert:
             stderr=subprocess.PIPE,
         )
 
-        self.write_buffer = Queue()
-        self.read_buffer = bytearray()
+        self.read_buffer = deque()
+        self._head_off = 0
+        self._read_size = 0
 
         self._stopped = Event()
         self._buf_lock = Lock()
+        self._write_lock = Lock()
 
-        self._write_thread = Thread(target=self._write_thread_fun, daemon=True)
         self._read_thread = Thread(target=self._read_thread_fun, daemon=True)
-        self._write_thread.start()
         self._read_thread.start()
+        self._err_thread = Thread(target=self._err_thread_fun, daemon=True)
+        self._err_thread.start()
 
-    def write(self, data: bytes):
-        if not self._stopped.is_set():
-            self.write_buffer.put(data)
+    def write(self, data: bytes | memoryview):
+        # stdout is drained by _read_thread, so ffmpeg keeps consuming stdin
+        assert self.ffmpeg_stream.stdin is not None
+        with self._write_lock:
+            if self._stopped.is_set() or self.ffmpeg_stream.stdin.closed:
+                return
+            try:
+                self.ffmpeg_stream.stdin.write(memoryview(data))
+            except BrokenPipeError:
+                pass  # ffmpeg exited
 
     def read(self, n: int = -1) -> bytes:
         N = n * self.channels * 2  # bytes per channel
+        out: list[memoryview] = []
         with self._buf_lock:
-            if n < 0:  # draw all
-                res = self.read_buffer
-                self.read_buffer = bytearray()
-            else:
-                res = self.read_buffer[:N]
-                self.read_buffer = self.read_buffer[N:]
-        return bytes(res)
+            if n < 0 or N > self._read_size:  # draw all
+                N = self._read_size
+            left = N
+            while left > 0:
+                chunk = self.read_buffer[0]
+                avail = len(chunk) - self._head_off
+                if avail > left:
+                    out.append(chunk[self._head_off : self._head_off + left])
+                    self._head_off += left
+                    break
+                out.append(chunk[self._head_off :])
+                self.read_buffer.popleft()
+                self._head_off = 0
+                left -= avail
+            self._read_size -= N
+        return b"".join(out)
+
+    def readinto(self, buf: memoryview) -> int:
+        """Copy whole frames into buf, returns the number of bytes copied."""
+        frame = self.channels * 2
+        with self._buf_lock:
+            N = min(len(buf), self._read_size)
+            N -= N % frame
+            pos = 0
+            while pos < N:
+                chunk = self.read_buffer[0]
+                take = min(len(chunk) - self._head_off, N - pos)
+                buf[pos : pos + take] = chunk[self._head_off : self._head_off + take]
+                pos += take
+                self._head_off += take
+                if self._head_off == len(chunk):
+                    self.read_buffer.popleft()
+                    self._head_off = 0
+            self._read_size -= N
+        return N
 
     def flush(self):
-        while self.write_buffer.qsize() > 0:
-            try:
-                self.write_buffer.get_nowait()
-            except Empty:
-                pass  # because data race
-
         assert self.ffmpeg_stream.stdin is not None
-        if not self.ffmpeg_stream.stdin.closed:
-            self.ffmpeg_stream.stdin.flush()
+        with self._write_lock:
+            if not self.ffmpeg_stream.stdin.closed:
+                self.ffmpeg_stream.stdin.flush()
 
         with self._buf_lock:
-            self.read_buffer = bytearray()
-
-        assert self.ffmpeg_stream.stdout is not None
-        self.ffmpeg_stream.stdout.flush()
+            self.read_buffer.clear()
+            self._head_off = 0
+            self._read_size = 0
 
     def join(self):
-        self.write_buffer.put(None)
-        self._write_thread.join()
-
         assert self.ffmpeg_stream.stdin is not None
-        if not self.ffmpeg_stream.stdin.closed:
-            self.ffmpeg_stream.stdin.close()
+        with self._write_lock:
+            if not self.ffmpeg_stream.stdin.closed:
+                self.ffmpeg_stream.stdin.close()
 
         self._read_thread.join()
 
@@ -120,21 +153,22 @@ class StreamConvert:
         self.flush()
         self.join()
 
-    def _write_thread_fun(self):
-        assert self.ffmpeg_stream.stdin is not None
-
-        while not self._stopped.is_set():
-            chunk = self.write_buffer.get()
-            if chunk is None:
-                break
-            self.ffmpeg_stream.stdin.write(chunk)
-
     def _read_thread_fun(self):
         assert self.ffmpeg_stream.stdout is not None
+        fd = self.ffmpeg_stream.stdout.fileno()
 
         while not self._stopped.is_set():
-            chunk = self.ffmpeg_stream.stdout.read(StreamConvert.CHUNK_SIZE)
+            # blocks until output is ready, then drains up to CHUNK_SIZE at once
+            chunk = os.read(fd, StreamConvert.CHUNK_SIZE)
             if not chunk:
                 break
             with self._buf_lock:
-                self.read_buffer.extend(chunk)
+                self.read_buffer.append(memoryview(chunk))
+                self._read_size += len(chunk)
+
+    def _err_thread_fun(self):
+        assert self.ffmpeg_stream.stderr is not None
+        # -loglevel error, so anything here is worth showing
+        for line in self.ffmpeg_stream.stderr:
+            print("ffmpeg:", line.decode(errors="replace").rstrip())
+        self.ffmpeg_stream.stderr.close()
@@ -1,11 +1,14 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 import threading
 import time
 import os
 
 import requests
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from websockets.sync.client import connect as ws_connect
 
 from .stream import StreamPlayback
-from ..types import Instance, Track
+from ..types import DownloadInfo, Instance, Track
 from ..downloads import Finder
 
 
@@ -13,6 +16,9 @@ class SyncPlayer:
     # static
     CHUNK_HTTP = 64 * 1024  # bytes read from HTTP each iteration
     POLL_TIME = 1
+    HTTP_TIMEOUT = 5  # seconds
+    WATCH_TIMEOUT = 1  # seconds between checks for close/room change while watching
+    WATCH_RETRY = 1  # seconds to wait before reconnecting a closed watch
 
     # fields
     playing: bool
@@ -20,14 +26,22 @@ class SyncPlayer:
     host: str
     port: int
     addr: str
+    session: requests.Session
+    download_session: requests.Session  # download thread only, downloads never overlap
+    watch_supported: bool  # server pushes updates on /watch/<room>
 
     room: str | None
+    _update_url: str  # poll url for room, set with it
     playback: StreamPlayback
     poll_thread: threading.Thread
     download_thread: threading.Thread | None
+    _dl_cancel: threading.Event  # set to stop the running download
 
     current_track: Track | None
 
+    _prefetch_executor: ThreadPoolExecutor
+    _prefetch: tuple[str, Future[DownloadInfo]] | None  # next track id, its lookup
+
     def __init__(self):
         self.playing = True
 
@@ -35,16 +49,30 @@ class SyncPlayer:
         self.port = int(os.getenv("SYNC_PORT", 5400))
         self.addr = f"http://{self.host}:{self.port}"
 
-        self.room = os.getenv("SYNC_ROOM", None)
-        self.playback = StreamPlayback()
-        self.poll_thread = threading.Thread(target=self.poll_thread_fun)
-        self.poll_thread.start()
-        self.download_thread = None
+        # keep-alive connection to the sync server, reused between polls
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "identity"})  # small JSON
+        self.download_session = requests.Session()
+        self.download_session.headers.update({"Accept-Encoding": "identity"})
+        self.watch_supported = True
 
         self.current_track = None
         self.finder = Finder()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetch = None
+
+        self.room = None
+        room = os.getenv("SYNC_ROOM", None)
+        if room is not None:
+            self.connect(room)
+        self.playback = StreamPlayback()
+        self.download_thread = None
+        self._dl_cancel = threading.Event()
+        self.poll_thread = threading.Thread(target=self.poll_thread_fun)
+        self.poll_thread.start()
 
     def connect(self, uid: str):
+        self._update_url = f"{self.addr}/update/{uid}"
         self.room = uid
 
     def poll_thread_fun(self):
@@ -53,60 +81,123 @@ class SyncPlayer:
                 time.sleep(1)
                 continue
 
-            resp = requests.get(self.addr + f"/update/{str(self.room)}")
+            if self.watch_supported:
+                try:
+                    self.watch(self.room)
+                except (ConnectionClosed, OSError):
+                    time.sleep(SyncPlayer.WATCH_RETRY)  # reconnect, don't spin
+                if self.watch_supported:
+                    continue
+
+            resp = self.session.get(self._update_url, timeout=SyncPlayer.HTTP_TIMEOUT)
             assert resp.status_code == 200
-            inst = Instance.model_validate_json(resp.content.decode())
+            self.apply(Instance.model_validate_json(resp.content))
 
-            if inst.track is None:
-                self.playback.stop()
-            elif self.current_track != inst.track:
+            time.sleep(SyncPlayer.POLL_TIME)
+
+    def watch(self, room: str):
+        """Apply Instance updates pushed by the server until closed or room changes."""
+        try:
+            ws = ws_connect(
+                f"ws://{self.host}:{self.port}/watch/{room}",
+                open_timeout=SyncPlayer.HTTP_TIMEOUT,
+            )
+        except InvalidHandshake as e:  # server rejected /watch, connection errors retry
+            print(f"Watch is unavailable, polling instead: {str(e)}")
+            self.watch_supported = False
+            return
+
+        with ws:
+            while self.playing and self.room == room:
+                try:
+                    msg = ws.recv(timeout=SyncPlayer.WATCH_TIMEOUT)
+                except TimeoutError:
+                    continue
+                self.apply(Instance.model_validate_json(msg))
+
+    def apply(self, inst: Instance):
+        if inst.track is None:
+            self.playback.stop()
+        elif self.current_track != inst.track:
+            self.playback.stop()
+            self.schedule_download(inst.track)
+            self.current_track = inst.track
+            if inst.next_track is not None:
+                self.prefetch(inst.next_track)
+            # pushed updates may not repeat, so apply the state right away
+            self.apply_state(inst)
+        else:
+            self.apply_state(inst)
+
+    def apply_state(self, inst: Instance):
+        match inst.playback.state:
+            case "Paused":
+                self.playback.pause()
+            case "Playing":
+                self.playback.resume()
+            case "Stopped":
                 self.playback.stop()
-                self.schedule_download(inst.track)
-                self.current_track = inst.track
-            else:
-                match inst.playback.state:
-                    case "Paused":
-                        self.playback.pause()
-                    case "Playing":
-                        self.playback.resume()
-                    case "Stopped":
-                        self.playback.stop()
 
-            time.sleep(SyncPlayer.POLL_TIME)
+    def prefetch(self, track: Track):
+        """Resolve DownloadInfo for track in background, for a quick switch to it."""
+        if self._prefetch is not None and self._prefetch[0] == track.id:
+            return
+        future = self._prefetch_executor.submit(self.finder.find, track)
+        self._prefetch = (track.id, future)
 
     def schedule_download(self, track: Track):
+        if self._prefetch is not None and self._prefetch[0] == track.id:
+            # wait for it to land in the finder cache, find() then applies the url TTL
+            try:
+                self._prefetch[1].result()
+            except Exception as e:
+                print(f"Prefetch of {track.title} failed: {str(e)}")
+            self._prefetch = None
         dinfo = self.finder.find(track)
 
+        # the old download must be gone before the stream is reset under it
+        self._dl_cancel.set()
+        if self.download_thread is not None:
+            self.download_thread.join()
+        self._dl_cancel = threading.Event()
+
         self.playback.init_stream(dinfo.decryption_key)
         self.playback.reopen_convert()
 
         print(f"Now playing: {track.artist} - {track.title}", flush=True)
 
-        if self.download_thread is not None and self.download_thread.is_alive():
-            self.download_thread.join(timeout=1)
         self.download_thread = threading.Thread(
             target=self.download_thread_fun,
-            args=(dinfo.url,),
+            args=(dinfo.url, self._dl_cancel),
             daemon=True,
         )
         self.download_thread.start()
 
-    def download_thread_fun(self, url: str):
-        # Start HTTP stream
-        resp = requests.get(url, stream=True)
-        resp.raise_for_status()
-
-        N = 0
-        for chunk in resp.iter_content(SyncPlayer.CHUNK_HTTP):
-            if not chunk:
-                continue
-            self.playback.write(chunk)
-            N += len(chunk)
+    def download_thread_fun(self, url: str, cancel: threading.Event):
+        # Start HTTP stream, the session asks for identity encoding,
+        # so raw bytes are the file
+        with self.download_session.get(
+            url, stream=True, timeout=SyncPlayer.HTTP_TIMEOUT
+        ) as resp:  # closed on exit, so a cancelled download frees its socket
+            resp.raise_for_status()
+
+            N = 0
+            for chunk in resp.raw.stream(SyncPlayer.CHUNK_HTTP, decode_content=False):
+                if cancel.is_set():
+                    return
+                if not chunk:
+                    continue
+                self.playback.write(chunk)
+                N += len(chunk)
 
     def close(self):
         self.playing = False
+        self._dl_cancel.set()
 
         self.playback.close(timeout=1)
         if self.download_thread is not None:
             self.download_thread.join()
         self.poll_thread.join()
+        self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        self.download_session.close()
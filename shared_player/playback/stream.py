@@ -1,12 +1,21 @@
-from threading import Event, Thread, Lock
+from binascii import unhexlify
+from functools import partial
+from threading import Event, Lock
+from typing import Any, Callable
 
 import numpy as np
-import pyaudio
+import sounddevice as sd
 from Crypto.Cipher import AES
 from Crypto.Cipher._mode_ctr import CtrMode
 
 from .convert import StreamConvert
 
+ZERO_NONCE = bytes(12)  # Yandex tracks are AES-CTR with an all-zero nonce
+
+
+def _identity(chunk: bytes) -> bytes:
+    return chunk
+
 
 class StreamPlayback:
     # static props
@@ -14,27 +23,37 @@ class StreamPlayback:
     FF_OUTPUT_SAMPLE_RATE = 44100
     FF_OUTPUT_CHANNELS = 2
     FF_OUTPUT_FORMAT = "s16le"  # signed 16-bit little-endian PCM
+    BYTES_PER_FRAME = FF_OUTPUT_CHANNELS * 2  # s16le
+    SCRATCH_SAMPLES = FF_OUTPUT_SAMPLE_RATE * FF_OUTPUT_CHANNELS  # 1 s of audio
+    FRAMES_PER_BUFFER = 1024  # ~23 ms, frames PortAudio asks for per callback
 
     # properties
     timeout: float | None
 
     cipher: CtrMode | None
+    _decrypt: Callable[[bytes], bytes | memoryview]  # bound per stream in init_stream
+    _decrypt_buf: bytearray  # reused decrypt output
+    _write_lock: Lock  # serializes writers, guards cipher and _decrypt_buf
     convert_stream: StreamConvert
     convert_stream_lock: Lock
 
-    _pd: pyaudio.PyAudio
-    audio_stream: pyaudio.Stream
-    audio_stream_lock: Lock
-    audio_thread: Thread
+    audio_stream: sd.RawOutputStream  # PortAudio pulls from _sd_callback
+    _pcm_buf: bytearray  # PCM read from convert_stream, callback only
+    _scratch_i32: np.ndarray  # volume scaling work buffer, callback only
     _stopped: Event
     _waiting: Event
+    _finished: Event  # audio stream has stopped
 
-    volume: float  # from 0 to 1
+    _volume: float  # from 0 to 1
+    _vol_q15: int  # volume in Q15 fixed point, 1.0 == 2**15
     unpaused: Event
 
     def __init__(self, timeout: float | None = 1):
         self.timeout = timeout
         self.cipher = None
+        self._decrypt = _identity
+        self._decrypt_buf = bytearray(StreamPlayback.CHUNK_HTTP)
+        self._write_lock = Lock()
         self.convert_stream_lock = Lock()
         self.convert_stream = StreamConvert(
             StreamPlayback.FF_OUTPUT_FORMAT,
@@ -42,22 +61,34 @@ class StreamPlayback:
             StreamPlayback.FF_OUTPUT_CHANNELS,
         )
 
-        self._pd = pyaudio.PyAudio()
         self.volume = 0.2
         self.unpaused = Event()
         self.unpaused.set()
 
-        self.audio_stream_lock = Lock()
-        self.audio_stream = self._pd.open(
-            format=pyaudio.paInt16,
-            channels=StreamPlayback.FF_OUTPUT_CHANNELS,
-            rate=StreamPlayback.FF_OUTPUT_SAMPLE_RATE,
-            output=True,
-        )
+        self._pcm_buf = bytearray(StreamPlayback.SCRATCH_SAMPLES * 2)
+        self._scratch_i32 = np.empty(StreamPlayback.SCRATCH_SAMPLES, dtype=np.int32)
         self._stopped = Event()
         self._waiting = Event()
-        self.audio_thread = Thread(target=self.audio_thread_fun, daemon=True)
-        self.audio_thread.start()
+        self._finished = Event()
+
+        self.audio_stream = sd.RawOutputStream(
+            samplerate=StreamPlayback.FF_OUTPUT_SAMPLE_RATE,
+            channels=StreamPlayback.FF_OUTPUT_CHANNELS,
+            dtype="int16",
+            blocksize=StreamPlayback.FRAMES_PER_BUFFER,
+            callback=self._sd_callback,
+            finished_callback=self._finished.set,
+        )
+        self.audio_stream.start()
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        self._volume = value
+        self._vol_q15 = min(int(value * 2**15), 2**16)  # keeps the product in int32
 
     def pause(self):
         self.unpaused.clear()
@@ -70,15 +101,19 @@ class StreamPlayback:
         self.unpaused.set()
 
     def init_stream(self, decryption_key: str | None):
-        with self.convert_stream_lock, self.audio_stream_lock:
+        with self._write_lock, self.convert_stream_lock:
             self.convert_stream.flush()
 
+            # a track without a key must not go through the previous track's cipher
+            self.cipher = None
+            self._decrypt = _identity
             if decryption_key is not None:
-                key_bytes = bytes.fromhex(decryption_key)
-                self.cipher = AES.new(key_bytes, nonce=bytes(12), mode=AES.MODE_CTR)
+                key_bytes = unhexlify(decryption_key)
+                self.cipher = AES.new(key_bytes, nonce=ZERO_NONCE, mode=AES.MODE_CTR)
+                self._decrypt = partial(self._decrypt_ctr, self.cipher)
 
     def reopen_convert(self):
-        with self.convert_stream_lock:
+        with self._write_lock, self.convert_stream_lock:
             self.convert_stream.close()
             self.convert_stream = StreamConvert(
                 StreamPlayback.FF_OUTPUT_FORMAT,
@@ -87,52 +122,79 @@ class StreamPlayback:
             )
 
     def write(self, chunk: bytes):
-        with self.convert_stream_lock:
-            if self.cipher:
-                chunk = self.cipher.decrypt(chunk)
-            if not self._stopped.is_set():
-                self.convert_stream.write(chunk)
+        # convert_stream_lock is only taken to pick the converter, so decrypting and
+        # a pipe write that blocks never stall the audio thread
+        with self._write_lock:
+            data = self._decrypt(chunk)
 
-    def audio_thread_fun(self):
+            with self.convert_stream_lock:
+                convert_stream = self.convert_stream
+            if not self._stopped.is_set():
+                convert_stream.write(data)
+
+    def _decrypt_ctr(self, cipher: CtrMode, chunk: bytes) -> memoryview:
+        # convert_stream.write is synchronous, so the buffer is free again after it
+        n = len(chunk)
+        if n > len(self._decrypt_buf):
+            self._decrypt_buf = bytearray(n)
+        data = memoryview(self._decrypt_buf)[:n]
+        cipher.decrypt(chunk, output=data)
+        return data
+
+    def _sd_callback(self, outdata: Any, frames: int, time_info: Any, status: Any):
         try:
-            while not self._stopped.is_set():
-                self.unpaused.wait()
-
-                with self.convert_stream_lock:
-                    N = self.audio_stream.get_write_available()
-                    N *= self.convert_stream.channels * 2  # bytes per channel
-                    if N == 0:
-                        continue
-
-                    data = self.convert_stream.read(N)
-                    if not data:
-                        if self._waiting.is_set():
-                            break
-                        continue
-
-                samples = np.frombuffer(data, dtype=np.int16)
-                samples_f = samples.astype(np.float32) / (2**15)
-                samples_f *= self.volume
-                samples_f = np.clip(samples_f, -1.0, 1.0)
-                data = (samples_f * (2**15)).astype(np.int16).tobytes()
-
-                with self.audio_stream_lock:
-                    self.audio_stream.write(data)
+            self._fill(outdata, frames)
+        except sd.CallbackStop:
+            raise
         except Exception as e:
             print("Playback error:", e)
+            raise sd.CallbackAbort
+
+    def _fill(self, outdata: Any, frame_count: int):
+        # scaled samples go straight into PortAudio's buffer
+        out = np.frombuffer(outdata, dtype=np.int16)
+        if self._stopped.is_set():
+            out[:] = 0
+            raise sd.CallbackStop
+
+        N = frame_count * StreamPlayback.BYTES_PER_FRAME
+        if N > len(self._pcm_buf):
+            self._pcm_buf = bytearray(N)
+        if N // 2 > self._scratch_i32.size:
+            self._scratch_i32 = np.empty(N // 2, dtype=np.int32)
+
+        read = 0
+        if self.unpaused.is_set():  # paused plays silence, keeping the PCM
+            with self.convert_stream_lock:
+                read = self.convert_stream.readinto(memoryview(self._pcm_buf)[:N])
+
+        # fixed-point scaling, int32 holds int16 * Q15 without overflow
+        vol_q15 = self._vol_q15
+        k = read // 2
+        samples = np.frombuffer(self._pcm_buf, dtype=np.int16, count=k)
+        work = self._scratch_i32[:k]
+        np.multiply(samples, vol_q15, out=work, dtype=np.int32)
+        np.right_shift(work, 15, out=work)
+        if vol_q15 > 2**15:  # can't overflow otherwise
+            np.clip(work, -(2**15), 2**15 - 1, out=work)
+        np.copyto(out[:k], work, casting="unsafe")
+        out[k:] = 0  # underrun, pad with silence so the stream keeps running
+
+        if not read and self._waiting.is_set():
+            raise sd.CallbackStop
 
     def close(self, timeout: float | None = 1):
         if timeout is None:  # wait until the track is over
-            with self.convert_stream_lock:  # prohibit writing
+            with self._write_lock:  # prohibit writing
                 self.convert_stream.join()
             self._waiting.set()
         else:
             self.convert_stream.close()
             self._stopped.set()
-        self.unpaused.set()  # unblock audio_thread
+        self.unpaused.set()  # let the callback drain what is left
 
-        if self.audio_thread.is_alive():
-            self.audio_thread.join(timeout=timeout)
+        self._finished.wait(timeout=timeout)
+        self.audio_stream.close()  # discards what is left if the wait timed out
 
     def __enter__(self) -> "StreamPlayback":
         return self
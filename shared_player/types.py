@@ -1,20 +1,26 @@
 from datetime import datetime
+from functools import cached_property
 import time
 from typing import Any, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 Source = Literal["Youtube", "Yandex", "Spotify", "Local"]
 DiscoverySource = Literal["Yandex", "WinRT"]
 
 
 class Track(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     source: Source
     id: str
     title: str
     artist: str
     duration_ms: int
 
+    def __hash__(self) -> int:
+        return hash((self.source, self.id))
+
 
 class Playback(BaseModel):
     state: Literal["Playing", "Paused", "Stopped"]
@@ -36,14 +42,18 @@ class Playback(BaseModel):
             case _:
                 return "Stopped"
 
+    @cached_property
+    def started_ms(self) -> int:  # unix ms, playbacks are never mutated
+        return int(self.updated_at * 1000) - self.position_ms
+
     def get_started(self) -> float:
-        return self.updated_at - self.position_ms / 1000
+        return self.started_ms / 1000
 
     def __eq__(self, other: "Playback") -> bool:
         if self.state != other.state:
             return False
         if self.state == "Playing":
-            if abs(self.get_started() - other.get_started()) < 1:
+            if abs(self.started_ms - other.started_ms) < 1000:
                 return True
         return self.position_ms == other.position_ms
 
@@ -51,9 +61,20 @@ class Playback(BaseModel):
 class Update(BaseModel):
     track: Track
     playback: Playback
+    next_track: Track | None = None  # hint for prefetching, not compared
 
     def __eq__(self, other: "Update") -> bool:
-        return self.track == other.track and self.playback == other.playback
+        if self.track is not other.track:
+            if self.track.source == "Local":
+                # local ids are just titles, artist or duration may still change
+                if self.track != other.track:
+                    return False
+            elif (
+                self.track.source != other.track.source
+                or self.track.id != other.track.id
+            ):  # source and id identify a track, the rest follows from them
+                return False
+        return self.playback == other.playback
 
     def format(self) -> str:
         track = f"{self.track.artist} - {self.track.title}"
@@ -75,6 +96,7 @@ class Instance(BaseModel):
     track: Track | None
     playback: Playback
     host_recv_ts: float  # unix
+    next_track: Track | None = None
 
     @staticmethod
     def new(uid: str, expiry: float) -> "Instance":